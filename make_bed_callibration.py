@@ -7,7 +7,7 @@ in the proprietary header/marker lines the S1 firmware insists on seeing.
 
 Example usage
 -------------
-python make_z_grid.py --x 5 --y 4 --min -0.40 --max 0.05 --bed 65 --nozzle 220
+python make_bed_callibration.py --x 5 --y 4 --min -0.40 --max 0.05 --bed 65 --nozzle 220
 """
 
 from pathlib import Path
@@ -19,112 +19,144 @@ def filament_len(dist_mm, layer_h, line_w, mult=1.0, dia=1.75):
     """Return filament length (mm) for a straight move of *dist_mm*."""
     return dist_mm * line_w * layer_h * mult / (math.pi * (dia / 2) ** 2)
 
-def f3(val):  # short float formatter
-    return f"{val:.3f}"
+def linspace(lo, hi, n, ndigits=3):
+    """Return *n* evenly spaced values from *lo* to *hi*, rounded to *ndigits*."""
+    if n == 1:
+        return [round(lo, ndigits)]
+    step = (hi - lo) / (n - 1)
+    return [round(lo + i * step, ndigits) for i in range(n)]
+
+# ──────────────────────── fixed blocks ───────────────────────
+# 1) Cura-style metadata header (must precede Anycubic blocks)
+# 2) Anycubic’s header / executable markers (";TYPE:Custom" is required,
+#    the blank M117 LCD message is fine, T0 is an explicit tool select)
+# 3) Warm-up & prime
+HEADER = """\
+;FLAVOR:Marlin
+;TIME:1
+;Filament used: 0.01m
+;Layer height:{layer_height:.2f}
+;MINX:0 ;MINY:0 ;MINZ:0
+;MAXX:{bed_x} ;MAXY:{bed_y} ;MAXZ:{square_height}
+; HEADER_BLOCK_START
+; generated {now}
+; total layer number: {layers}
+; filament_diameter: 1.75
+; max_z_height: {square_height:.2f}
+; HEADER_BLOCK_END
+
+; EXECUTABLE_BLOCK_START
+;TYPE:Custom
+G9111 bedTemp={bed} extruderTemp={nozzle}
+M117
+G90
+G21
+M83
+T0
+M190 S{bed}
+M109 S{nozzle}
+G28
+G1 Z5 F3000
+G1 X5 Y5 F6000
+G1 Z0.3 F600
+G1 E2 F120
+G92 E0
+"""
+
+# 6) End-gcode (copied from slicer profile)
+FOOTER = b"""\
+G1 Z20 F900
+G92 E0
+G1 E-2 F3000
+G1 F12000
+G1 X44
+G1 Y270
+M140 S0
+M104 S0
+M106 P1 S0
+M106 P2 S0
+M106 P3 S0
+M84
+; EXECUTABLE_BLOCK_END
+"""
+
+# One layer of one square: travel to the corner, four extruded sides, then
+# reset extrusion. Filled with a single %-format per square.
+PERIMETER = (
+    b"G1 X%.3f Y%.3f F%d\n"
+    + b"G1 X%.3f Y%.3f E%.3f F%d\n" * 4
+    + b"G92 E0\n"
+)
 
 # ──────────────────────── g-code builder ─────────────────────
-def build(cfg):
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def build(cfg, *, now=None):
+    """Write the calibration G-code for *cfg* and return its path.
+
+    *now* is the "generated" timestamp for the header; pass a preformatted
+    string to skip the clock lookup (e.g. when sweeping many parameter sets).
+    The string must be ASCII, since the file is written as plain ASCII.
+    """
+    if now is None:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    elif not now.isascii():
+        raise ValueError(f"now must be an ASCII string, got {now!r}")
     layers = int(cfg['square_height'] / cfg['layer_height'])
 
-    # 1) Cura-style metadata header (must precede Anycubic blocks)
-    preheader = [
-        ";FLAVOR:Marlin",
-        ";TIME:1",
-        ";Filament used: 0.01m",
-        f";Layer height:{cfg['layer_height']:.2f}",
-        ";MINX:0 ;MINY:0 ;MINZ:0",
-        f";MAXX:{cfg['bed_x']} ;MAXY:{cfg['bed_y']} ;MAXZ:{cfg['square_height']}",
-    ]
-
-    # 2) Anycubic’s header / executable markers
-    g = preheader + [
-        "; HEADER_BLOCK_START",
-        f"; generated {now}",
-        f"; total layer number: {layers}",
-        "; filament_diameter: 1.75",
-        f"; max_z_height: {cfg['square_height']:.2f}",
-        "; HEADER_BLOCK_END",
-        "",
-        "; EXECUTABLE_BLOCK_START",
-        ";TYPE:Custom",                                    # <- required
-        f"G9111 bedTemp={cfg['bed']} extruderTemp={cfg['nozzle']}",
-        "M117",                                            # LCD message (blank is fine)
-        "G90", "G21", "M83",
-        "T0",                                              # explicit tool select
-    ]
-
-    # 3) Warm-up & prime
-    g += [
-        f"M190 S{cfg['bed']}",
-        f"M109 S{cfg['nozzle']}",
-        "G28",
-        "G1 Z5 F3000",
-        "G1 X5 Y5 F6000",
-        "G1 Z0.3 F600",
-        "G1 E2 F120", "G92 E0",
-    ]
+    # Build the header before opening the file, so a bad header cannot
+    # truncate an existing output.
+    header = HEADER.format(now=now, layers=layers, **cfg).encode("ascii")
+
+    # Stream everything straight to disk; the grid section can get large.
+    out = Path("z_offset_calibration.gcode")
+    with open(out, "wb", buffering=1 << 20) as f:   # G-code is plain ASCII
+        write = f.write
+        write(header)
+        _write_grid(write, cfg, layers)
+        write(FOOTER)
+    return out
+
+def grid_plan(cfg):
+    """Return (ox, oy, z_off) for every square, in print order."""
+    nx, ny, size, gap = cfg['x'], cfg['y'], cfg['size'], cfg['gap']
 
     # 4) Grid placement math
-    grid_w = cfg['x'] * cfg['size'] + (cfg['x'] - 1) * cfg['gap']
-    grid_h = cfg['y'] * cfg['size'] + (cfg['y'] - 1) * cfg['gap']
+    grid_w = nx * size + (nx - 1) * gap
+    grid_h = ny * size + (ny - 1) * gap
     start_x = (cfg['bed_x'] - grid_w) / 2
     start_y = (cfg['bed_y'] - grid_h) / 2
-
-    total = cfg['x'] * cfg['y']
-    z_vals = [round(cfg['z_min'] + i * (cfg['z_max'] - cfg['z_min']) / (total - 1), 3)
-              for i in range(total)]
-
-    # 5) Draw the squares
-    idx = 0
-    for row in range(cfg['y']):
-        for col in range(cfg['x']):
-            z_off = z_vals[idx]
-            idx += 1
-            ox = start_x + col * (cfg['size'] + cfg['gap'])
-            oy = start_y + row * (cfg['size'] + cfg['gap'])
-
-            g.append(f";--- Square {idx}/{total}  Z={z_off:+.3f} ---")
-            g.append(f"M117 Z {z_off:+.2f}")
-
-            for ly in range(layers):
-                z = (ly + 1) * cfg['layer_height'] + z_off
-                g.append(f"G1 Z{f3(z)} F600")
-
-                path = [
-                    (ox, oy),
-                    (ox + cfg['size'], oy),
-                    (ox + cfg['size'], oy + cfg['size']),
-                    (ox, oy + cfg['size']),
-                    (ox, oy),
-                ]
-                g.append(f"G1 X{f3(path[0][0])} Y{f3(path[0][1])} F{cfg['travel']*60}")
-                px, py = path[0]
-
-                for x, y in path[1:]:
-                    dist = math.hypot(x - px, y - py)
-                    e = filament_len(dist, cfg['layer_height'], cfg['line_width'], cfg['mult'])
-                    g.append(f"G1 X{f3(x)} Y{f3(y)} E{f3(e)} F{cfg['print']*60}")
-                    px, py = x, y
-                g.append("G92 E0")            # reset extrusion each layer
-
-    # 6) End-gcode (copied from slicer profile)
-    g += [
-        "G1 Z20 F900",
-        "G92 E0",
-        "G1 E-2 F3000",
-        "G1 F12000",
-        "G1 X44",
-        "G1 Y270",
-        "M140 S0", "M104 S0",
-        "M106 P1 S0", "M106 P2 S0", "M106 P3 S0",
-        "M84",
-        "; EXECUTABLE_BLOCK_END",
-    ]
-
-    out = Path("z_offset_calibration.gcode")
-    out.write_text("\n".join(g))
-    return out
+    pitch = size + gap
+    col_x = [start_x + col * pitch for col in range(nx)]
+    row_y = [start_y + row * pitch for row in range(ny)]
+
+    z_vals = iter(linspace(cfg['z_min'], cfg['z_max'], nx * ny))
+    return [(ox, oy, next(z_vals)) for oy in row_y for ox in col_x]
+
+def _write_grid(write, cfg, layers):
+    """Emit the squares of the calibration grid through *write*."""
+    # All geometry is worked out up front; the loop below only formats.
+    plan = grid_plan(cfg)
+    total = len(plan)
+    size, layer_h = cfg['size'], cfg['layer_height']
+    layer_z = [(ly + 1) * layer_h for ly in range(layers)]
+
+    # 5) Draw the squares (every side is the same length, so the same E)
+    e_side = filament_len(size, layer_h, cfg['line_width'], cfg['mult'])
+    travel_feed = cfg['travel'] * 60     # mm/s -> mm/min
+    print_feed = cfg['print'] * 60
+    # Corner offsets of one perimeter, walked from the start corner.
+    corners = ((size, 0), (size, size), (0, size), (0, 0))
+    for idx, (ox, oy, z_off) in enumerate(plan, 1):
+        write(b";--- Square %d/%d  Z=%+.3f ---\nM117 Z %+.2f\n"
+              % (idx, total, z_off, z_off))
+
+        # The perimeter is identical on every layer (M83: relative E), so
+        # format it once per square and only vary the Z move per layer.
+        args = [ox, oy, travel_feed]
+        for dx, dy in corners:
+            args += (ox + dx, oy + dy, e_side, print_feed)
+        moves = PERIMETER % tuple(args)
+
+        write(b"".join(b"G1 Z%.3f F600\n%b" % (lz + z_off, moves) for lz in layer_z))
 
 # ────────────────────────── CLI ─────────────────────────────
 if __name__ == "__main__":